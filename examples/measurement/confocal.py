@@ -12,6 +12,8 @@ from pharos.model.lib.general_functions import from_yaml_to_devices, from_yaml_t
 
 
 class measurement(object):
+    __slots__ = ('measure', 'devices', 'daqs', '_by_daq', 'init')
+
     def __init__(self, measure):
         """Measurement class that will hold all the information regarding the experiment being performed.
         :param measure: a dictionary (as in the python type "dictionary") with the necessary steps
@@ -19,10 +21,10 @@ class measurement(object):
         self.measure = measure  # Dictionary of the measurement steps
         self.devices = {}  # Dictionary holding all the devices
         self.daqs = {}  # Dictionary that holds for each daq the inputs and outputs.
+        self._by_daq = {}  # Devices connected through each daq, built when loading the devices.
 
-        # This short block is going to become useful in the future, when interfacing with a GUI
-        for d in self.measure:
-            setattr(self, d, self.measure[d])
+        # The steps used by name, the rest are read from self.measure
+        self.init = measure.get('init')
 
     def load_devices(self, source=None):
         """ Loads the devices from the files defined in the INIT part of the yml.
@@ -34,9 +36,12 @@ class measurement(object):
         init = self.measure['init']
         devices_file = init['devices']
         devices_list = from_yaml_to_devices(devices_file)
-        for dev in devices_list:
+        for dev in devices_list.values():
             self.devices[dev.properties['name']] = dev
             print('Added %s to the experiment' % dev)
+            connection = dev.properties['connection']
+            if 'device' in connection:
+                self._by_daq.setdefault(connection['device'], []).append(dev)
 
     def initialize_devices(self):
         """ Initializes the devices first by loading the driver,
@@ -63,10 +68,10 @@ class measurement(object):
         """ Iterates through the devices and appends the outputs and inputs to each daq.
         :return: None
         """
-        for d in self.devices:
-            dev = self.devices[d]  # Get the device from the devices list
-            if 'device' in dev.properties['connection']: #checks if a device is connected via another DAQ card, this is notified by defining a "nested device" in the connection property of the "sensory device"
-                connected_to = dev.properties['connection']['device']
+        # Devices connected via another DAQ card define a "nested device" in their connection property, they were
+        # grouped by that DAQ in load_devices
+        for connected_to, devs in self._by_daq.items():
+            for dev in devs:
                 mode = dev.properties['mode'] #can be input or output, will later be useful to create a categorial list
                 self.daqs[connected_to][mode].append(dev)
                 print('Appended %s to %s' % (dev, connected_to))
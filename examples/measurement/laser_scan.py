@@ -10,17 +10,23 @@
 import numpy as np
 import logging
 
+from contextlib import ExitStack
+from queue import Queue
+from threading import Thread
 from time import sleep
 from experimentor.experiment.base_experiment import Experiment
 
 from experimentor import Q_
 from experimentor.lib.general_functions import from_yaml_to_dict
 from experimentor.config import Config
+from experimentor.models.daq import DaqTask
 
 logger = logging.getLogger(__name__)
 
 
 class LaserScan(Experiment):
+    __slots__ = ('daqs', '_task_stack', '_saver', '_saver_queue')
+
     def __init__(self, measure):
         """Measurement class that will hold all the information regarding the experiment being performed.
         :param measure: a dictionary with the necessary steps
@@ -34,8 +40,27 @@ class LaserScan(Experiment):
         self.load_devices(devices)
         self.load_sensors(sensors)
         self.load_actuators(actuators)
-        self.initialize_devices()
+        self.initialize_devices(self.devices_in_use())
         self.daqs = {}  # Pace to store the DAQ devices that will be acquiring data
+        self._task_stack = ExitStack()  # Releases the tasks of the DAQs, see _configure_daqs
+        self._saver = None  # Thread saving the continuous scans, see start_saving
+        self._saver_queue = None
+
+    def devices_in_use(self):
+        """ Collects the devices that the scan and the monitor steps need: the laser, the detectors and the devices
+        along the axis. Only these are initialized at startup, the rest are initialized upon first access.
+
+        :return: set of device names.
+        """
+        used = set()
+        for step in (self.scan, self.monitor):
+            if step is None:
+                continue
+            if 'laser' in step:
+                used.add(step['laser']['name'])
+            used.update(step.get('detectors', {}))
+            used.update(d for d in step.get('axis', {}) if d != 'time')
+        return used
 
     def setup_scan(self):
         """ Prepares the scan by setting all the parameters to the DAQs and laser.
@@ -55,98 +80,93 @@ class LaserScan(Experiment):
         laser_params['wavelength_sweeps'] = 1
 
         laser.apply_values(laser_params)
-        num_points = 1+int(
-            (laser.params['stop_wavelength'] - laser.params['start_wavelength']) / laser.params['interval_trigger'])
-
-        # Estimated accuracy to set the DAQmx to.
-        accuracy = laser.params['interval_trigger'] / laser.params['wavelength_speed']
-
-        # Conditions to be passed to the DAQ.
-        conditions = {
-            'accuracy': accuracy,
-            'points': num_points
-        }
+        conditions, approx_time_to_scan = self._sweep_conditions(laser, 'interval_trigger')
+        self.scan['approx_time_to_scan'] = approx_time_to_scan
 
         # Then setup the ADQs
-        for device in self.scan['detectors']:
-            dev = self.devices[device]['dev']
-            sensors = []
-            if dev.properties['model'] == 'ni':
-                self.daqs[device]['dev'] = dev
-                self.logger.debug('NI card devices')
-                sens_to_monitor = self.scan['detectors'][device]
-                for sensor in sens_to_monitor:
-                    self.logger.debug('Setting up {} for scans'.format(sensor))
-                    if sensor not in self.devices[device]['sensors']:
-                        self.logger.warning('Trying to read {} from {}, but was not registered'.format(sensor, device))
-                        raise Warning('Sensor not found')
-                    else:
-                        s = self.devices[device]['sensors'][sensor]
-                        sensors.append(s)
-                self.logger.info('Going to monitor {} sensors.'.format(len(sensors)))
-                daq_driver = dev.driver
-                conditions.update({
-                    'sensors': sensors,
-                    'trigger': dev.properties['trigger'],
-                    'trigger_source': dev.properties['trigger_souruce'],
-                    'sampling': 'continuous',
-                })
-                self.scan_task = daq_driver.analog_input_setup(conditions)
-                daq_driver.trigger_analog()
-                self.daqs[device]['monitor'] = sensor
-                self.daqs[device]['monitor_task'] = self.scan_task
-            else:
-                self.logger.warning('Only NI cards are supported at this time')
+        self._configure_daqs(conditions, self.scan['detectors'])
 
     def do_scan(self):
         """ Does the scan considering that everything else was already set up.
         """
 
-        scan = self.scan
-        laser = self.devices[scan['laser']['name']]
-        axis = scan['axis']
-        approx_time_to_scan = (laser.params['stop_wavelength']-laser.params['start_wavelength'])/laser.params['wavelength_speed']
-        self.logger.info('Total number of devices to scan: {}'.format(len(axis)))
-        self.logger.info('Approximate time to do a laser scan: {}'.format(approx_time_to_scan))
-
-        if len(axis) != 1:
-            self.logger.warning('Trying to do a scan of {} dimensions. The program only supports 1 dimenstion'.format(len(axis)))
-            raise Warning('Wrong number of axis')
-
-        dev_to_scan = list(axis.keys())[-1] # Get the name of the device
-        self.logger.info('Device to scan: {}'.format(dev_to_scan))
-        actuator_to_scan = list(axis[dev_to_scan].keys())[-1]
-        self.logger.info('Actuator to scan: {}'.format(actuator_to_scan))
-        range = axis[dev_to_scan][actuator_to_scan]['rage']
-        self.logger.debug('Range to scan: {}'.format(range))
-        # Scan the laser and the values of the given device
-        if dev_to_scan != 'time':
-            start = Q_(range[0])
-            stop = Q_(range[1])
-            step = Q_(range[2])
-            units = start.u
-            num_points_dev = ((stop-start)/step).to('') + 1  # This is to include also the last point
-        else:
-            start = 1
-            stop = range[1]
-            num_points_dev = stop
-
-        for value in np.linspace(start, stop, num_points_dev):
+        # The tasks started by setup_scan are released also if the scan fails
+        with self._task_stack:
+            scan = self.scan
+            laser = self.devices[scan['laser']['name']]['dev']
+            axis = scan['axis']
+            approx_time_to_scan = scan['approx_time_to_scan']
+            self.logger.info('Total number of devices to scan: {}'.format(len(axis)))
+            self.logger.info('Approximate time to do a laser scan: {}'.format(approx_time_to_scan))
+
+            if len(axis) != 1:
+                self.logger.warning('Trying to do a scan of {} dimensions. The program only supports 1 dimenstion'.format(len(axis)))
+                raise Warning('Wrong number of axis')
+
+            dev_to_scan = list(axis.keys())[-1] # Get the name of the device
+            self.logger.info('Device to scan: {}'.format(dev_to_scan))
+            actuator_to_scan = list(axis[dev_to_scan].keys())[-1]
+            self.logger.info('Actuator to scan: {}'.format(actuator_to_scan))
+            scan_range = axis[dev_to_scan][actuator_to_scan]['range']
+            self.logger.debug('Range to scan: {}'.format(scan_range))
+            # Scan the laser and the values of the given device
             if dev_to_scan != 'time':
-                self.devices[dev_to_scan]['actuators'][actuator_to_scan].value = value * units
-                self.logger.debug('Set {} to {}'.format(actuator_to_scan, value))
-
-            laser.driver.execute_sweep()
-            self.logger.info('Executing laser sweep')
-            sleep(0.1)
-            while laser.driver.sweep_condition != 'Stop':
-                sleep(approx_time_to_scan.m/Config.Laser.number_checks_per_scan)
-
-        for device in self.scan['detectors']:
-            dev = self.devices[device]['dev']
-            daq_driver = dev.driver
-            daq_driver.stop_task()
-            daq_driver.clear_task()
+                # Plain magnitudes make the points a float array; units are attached only when setting a value
+                units = Q_(scan_range[0]).u
+                start = Q_(scan_range[0]).m_as(units)
+                stop = Q_(scan_range[1]).m_as(units)
+                step = Q_(scan_range[2]).m_as(units)
+                num_points_dev = int(round((stop-start)/step)) + 1  # This is to include also the last point
+            else:
+                start = 1
+                stop = scan_range[1]
+                num_points_dev = stop
+
+            # Bind what is used at every point of the scan, to avoid resolving it again on each iteration
+            laser_driver = laser.driver
+            # All the points are computed and validated at once, the loop itself only communicates with the devices
+            trajectory = np.linspace(start, stop, num_points_dev)
+            if dev_to_scan != 'time':
+                actuator = self.devices[dev_to_scan]['actuators'][actuator_to_scan]
+                trajectory = trajectory * units
+                if actuator.limits is not None:
+                    min_value, max_value = actuator.limits
+                    if np.any(trajectory < min_value) or np.any(trajectory > max_value):
+                        wrn_msg = 'Trying to scan {} from {} to {}, while limits are ({}, {})'.format(
+                            actuator_to_scan, trajectory[0], trajectory[-1], min_value, max_value)
+                        self.logger.warning(wrn_msg)
+                        raise Warning(wrn_msg)
+
+            for value in trajectory:
+                if dev_to_scan != 'time':
+                    actuator.value = value
+                    self.logger.debug('Set {} to {}'.format(actuator_to_scan, value))
+
+                laser_driver.execute_sweep()
+                self.logger.info('Executing laser sweep')
+                sleep(0.1)
+                self._wait_for_sweep(laser_driver, approx_time_to_scan)
+
+    def _wait_for_sweep(self, laser_driver, approx_time_to_scan):
+        """ Blocks until the laser finishes the sweep. The interval between checks starts at
+        Config.Laser.min_check_interval and doubles every time the condition of the laser stays the same, up to the
+        fraction of the sweep given by Config.Laser.number_checks_per_scan. It goes back to the minimum when the
+        condition changes, so the end of the sweep is detected promptly without querying the laser all the time.
+
+        :param laser_driver: Driver of the laser performing the sweep.
+        :param approx_time_to_scan: Approximate duration of the sweep, a Quantity.
+        """
+        max_interval = approx_time_to_scan.m_as('s')/Config.Laser.number_checks_per_scan
+        interval = min(Config.Laser.min_check_interval, max_interval)
+        last_condition = None
+        condition = laser_driver.sweep_condition
+        while condition != 'Stop':
+            if condition != last_condition:
+                interval = min(Config.Laser.min_check_interval, max_interval)
+            sleep(interval)
+            interval = min(2*interval, max_interval)
+            last_condition = condition
+            condition = laser_driver.sweep_condition
 
     def set_value_to_device(self, dev_name, value):
         """ Sets the value of the device. If it is an analog output, it takes just one value.
@@ -154,17 +174,18 @@ class LaserScan(Experiment):
         :param dev_name: name of the device to set the output
         :param value: value or dict of values to set the device to
         """
-        dev = self.devices[dev_name]
+        dev = self.devices[dev_name]['dev']
+        connection = dev.connection
         # If it is an analog channel
-        if dev.properties['connection']['type'] == 'daq':
-            daq = self.devices[dev.properties['connection']['device']]
+        if connection.type == 'daq':
+            daq = self.devices[connection.device]['dev']
             conditions = {
                 'dev': dev,
                 'value': value
             }
             daq.driver.analog_output_dc(conditions)
         else:
-            self.devices[dev.dev.properties['name']].apply_values(value)
+            dev.apply_values(value)
 
     def setup_continuous_scans(self, monitor=None):
         """ Sets up 1D scans. This is useful for monitoring a signal over time.
@@ -177,128 +198,201 @@ class LaserScan(Experiment):
             self.monitor = monitor
 
         # Lets grab the laser
-        laser = self.devices[monitor['laser']['name']]
+        laser = self.devices[monitor['laser']['name']]['dev']
         laser.apply_values(monitor['laser']['params'])
 
-        # Lets see what happens with the devices to monitor
-        devices_to_monitor = monitor['detectors']
-
         # Lets calculate the conditions of the scan
-        num_points = 1 + int(
-            (laser.params['stop_wavelength'] - laser.params['start_wavelength']) / laser.params['trigger_step'])
-
-        accuracy = laser.params['trigger_step'] / laser.params['wavelength_speed']
-
-        self.logger.debug('1D scan with {} number of points'.format(num_points))
-
-        approx_time_to_scan = (laser.params['stop_wavelength'] - laser.params['start_wavelength']) / laser.params[
-            'wavelength_speed']
+        conditions, approx_time_to_scan = self._sweep_conditions(laser, 'trigger_step')
+        self.logger.debug('1D scan with {} number of points'.format(conditions['points']))
         self.logger.debug('Approx time to scan: {}'.format(approx_time_to_scan))
+        monitor['approx_time_to_scan'] = approx_time_to_scan
 
-        self.measure['monitor']['approx_time_to_scan'] = approx_time_to_scan
+        # Then setup the ADQs
+        self._configure_daqs(conditions, monitor['detectors'])
 
+    def _sweep_conditions(self, laser, trigger_step):
+        """ Calculates the acquisition conditions of the DAQs from the parameters of a laser sweep.
+
+        :param laser: The laser Device, with the sweep parameters already applied.
+        :param trigger_step: Name of the laser parameter with the wavelength step between triggers.
+        :return: conditions to be passed to the DAQs (points and accuracy) and the approximate time of a sweep.
+        """
+        params = laser.params
+        span = params['stop_wavelength'] - params['start_wavelength']
         conditions = {
-            'accuracy': accuracy,
-            'points': num_points
+            'points': 1 + int(span / params[trigger_step]),
+            'accuracy': params[trigger_step] / params['wavelength_speed'],  # Estimated accuracy to set the DAQmx to.
         }
+        approx_time_to_scan = span / params['wavelength_speed']
+        return conditions, approx_time_to_scan
 
-        # Then setup the ADQs
-        for device in devices_to_monitor:
+    def _configure_daqs(self, conditions, detectors):
+        """ Sets up and triggers a continuous acquisition on every DAQ, reading the given sensors.
+        The DAQs, sensors and tasks are stored in self.daqs. The tasks are released all at once, by closing
+        self._task_stack.
+
+        :param conditions: Number of points and accuracy of the acquisition, as given by :meth:`_sweep_conditions`
+        :param detectors: Dictionary with the DAQs as keys and lists of sensor names as values.
+        """
+        for device in detectors:
             dev = self.devices[device]['dev']  # Get the DAQ.
-            sensors = []
             if dev.properties['model'] != 'ni':
                 self.logger.warning('Only NI Cards are supported at the moment.')
-                raise Warning('Onli NI cards are supported at the moment.')
-            self.daqs[device]['dev'] = dev
+                raise Warning('Only NI cards are supported at the moment.')
             self.logger.debug('NI card devices')
-            sens_to_monitor = monitor['detectors'][device]
-            for sensor in sens_to_monitor:
-                self.logger.debug('Setting up {} for monitor'.format(sensor))
+            monitor = {}  # Sensor name -> Sensor, in the order in which the channels are acquired
+            for sensor in detectors[device]:
+                self.logger.debug('Setting up {} for acquisition'.format(sensor))
                 if sensor not in self.devices[device]['sensors']:
                     self.logger.warning('Trying to read {} from {}, but it was not registered'.format(sensor, device))
                     raise Warning('Sensor not found')
-                else:
-                    s = self.devices[device]['sensor'][sensor]
-                    sensors.append(s)
-
-                self.logger.info('Going to monitor {} sensors'.format(len(sensors)))
-                daq_driver =dev.driver
-                conditions.update({
-                    'sensors': sensors,
-                    'trigger': dev.properties['trigger'],
-                    'trigger_source': dev.properties['trigger_source'],
-                    'sampling': 'continuous',
-                })
-                self.monitor_task = daq_driver.analog_input_setup(conditions)
-                daq_driver.trigger_analog()
-                self.daqs[device]['monitor'] = sensor
-                self.daqs[device]['monitor_task'] = self.monitor_task
+                if sensor in monitor:
+                    self.logger.warning('{} appears twice in the detectors of {}'.format(sensor, device))
+                monitor[sensor] = self.devices[device]['sensors'][sensor]
+
+            self.logger.info('Going to monitor {} sensors'.format(len(monitor)))
+            daq_driver = dev.driver
+            daq_conditions = dict(conditions)
+            daq_conditions.update({
+                'sensors': list(monitor.values()),
+                'trigger': dev.properties['trigger'],
+                'trigger_source': dev.properties['trigger_source'],
+                'sampling': 'continuous',
+            })
+            task = self._task_stack.enter_context(DaqTask(daq_driver, daq_driver.analog_input_setup(daq_conditions)))
+            daq_driver.trigger_analog(task)
+            self.daqs[device] = {
+                'dev': dev,
+                'monitor': monitor,
+                'monitor_task': task,
+                # Allocated once, every read of the continuous scans is stored here. One column per sensor.
+                'read_buffer': np.zeros((Config.ni_buffer, len(monitor)), dtype=np.float64),
+            }
 
     def start_continuous_scans(self):
         """Starts the laser, and triggers the daqs. It assumes setup_continuous_scans was already called."""
         monitor = self.monitor
-        laser = self.devices[monitor['laser']['name']]
+        laser = self.devices[monitor['laser']['name']]['dev']
         laser.driver.execute_sweep()
         self.logger.info('Executing laser sweep')
 
-    def read_continuous_scans(self, devs):
+    def read_continuous_scans(self, devs, copy=True):
         """ Reads the values being acquired while the scan is running.
         It is thought for monitoring signals in real time.
 
         :param devs: Devices to read from
         :type devs: list
+        :param bool copy: If False, the arrays returned are views on the read buffer of each DAQ and they are
+            overwritten by the next read. Only for callers that are done with the data before reading again.
         """
-        conditions = {'points': -1}  # To read all daqthe points available
-        data = {}
+        # All the DAQs are read at the same time, the data is collected afterwards
+        reads = []
         for d in devs:
             daq = self.daqs[d]
-            daq_driver = self.devices[d]
             if len(daq['monitor']) > 0:
-                vv, dd = daq_driver.driver.read_analog(daq['monitor_task'], conditions)
-                dd = dd[:vv*len(daq['monitor'])]
-                dd = np.reshape(dd, (len(daq['monitor']), int(vv)))
-                for i in range(len(daq['monitor'])):
-                    dev = daq['monitor'][i]
-                    data[dev.properties['name']] = dd[i,:]
+                buffer = daq['read_buffer']
+                reads.append((daq['monitor'], buffer,
+                              daq['dev'].driver.read_analog_into_async(daq['monitor_task'], buffer)))
+
+        data = {}
+        for monitor, buffer, read in reads:
+            num_samples = read.result()
+            # The buffer has one column per sensor, its transpose gives one row (a view, not a copy) per sensor.
+            rows = buffer[:num_samples].T
+            if copy:
+                rows = rows.copy()
+            data.update(zip(monitor, rows))
+
+        # stop_saving may run in another thread, the queue is taken only once
+        saver, queue = self._saver, self._saver_queue
+        if queue is not None:
+            if saver.is_alive():
+                # The arrays returned belong to the caller, the saver gets its own copy
+                for name in data:
+                    queue.put((name, data[name].copy()))
+            else:
+                # Nothing reads the queue anymore, the data would pile up in memory
+                self.logger.error('Saving the continuous scans stopped because of an error, the data is not stored')
+                self._saver_queue = None
         return data
+
+    def start_saving(self, filename, metadata=''):
+        """ Starts saving the data of the continuous scans. From now on, everything returned by
+        :meth:`read_continuous_scans` is also appended to an HDF5 file by a separate thread, so the acquisition does
+        not wait for the disk.
+
+        :param str filename: HDF5 file where to store the data, it is appended if it exists.
+        :param str metadata: Stored together with the data.
+        """
+        if self._saver is not None:
+            self.logger.warning('Already saving the continuous scans')
+            return
+        # h5py is only needed when saving, importing LaserScan should not depend on it
+        from experimentor.models.workerSaver import workerScanSaver
+        self._saver_queue = Queue()
+        self._saver = Thread(target=workerScanSaver, args=(filename, metadata, self._saver_queue), daemon=True)
+        self._saver.start()
+        self.logger.info('Saving continuous scans to {}'.format(filename))
+
+    def stop_saving(self):
+        """ Stops saving the continuous scans, waiting for the pending data to be written to disk."""
+        saver, queue = self._saver, self._saver_queue
+        if saver is None:
+            return
+        self._saver = None
+        self._saver_queue = None
+        if not saver.is_alive():
+            self.logger.error('Saving the continuous scans had already stopped because of an error')
+            return
+        queue.put('Stop')
+        saver.join()
     
     def stop_continuous_scans(self):
+        """ Stops the laser and releases the tasks of the DAQs."""
         monitor = self.monitor
-        laser = self.devices[monitor['laser']['name']].driver
+        laser = self.devices[monitor['laser']['name']]['dev'].driver
         laser.pause_sweep()
         laser.stop_sweep()
-        for d in self.daqs:
-            daq = self.daqs[d]
-            if len(daq['monitor']) > 0:
-                daq_driver = daq['dev'].driver
-                daq_driver.stop_task(daq['monitor_task'])
-                daq_driver.clear_task(daq['monitor_task'])
+        self._task_stack.close()
 
     def pause_continuous_scans(self):
         monitor = self.monitor
-        laser = self.devices[monitor['laser']['name']].driver
+        laser = self.devices[monitor['laser']['name']]['dev'].driver
         laser.pause_sweep()
 
     def resume_continuous_scans(self):
         monitor = self.monitor
-        laser = self.devices[monitor['laser']['name']].driver
+        laser = self.devices[monitor['laser']['name']]['dev'].driver
         laser.execute_sweep()
 
     def finalize(self):
         """ What to do when the program finishes."""
-        if not hasattr(self, 'finish'):
-            self.logger.warning('Class does not have a finalize statement')
+        self.stop_saving()
+        self._task_stack.close()
 
-        # Applies the given values to every device that appears in the finalize
-        for dev in self.finish:
-            self.logger.info('Finalizing {}'.format(dev))
-            values = self.finish[dev]
-            device = self.devices[dev]['dev']
-            device.apply_values(values)
-            try:
-                device.driver.finalize()
-            except:
-                self.logger.warning('Failed to finalize driver {}'.fromat(dev))
+        if self.finish is None:
+            self.logger.warning('Class does not have a finalize statement')
+        else:
+            # Applies the given values to every device that appears in the finalize
+            for dev in self.finish:
+                self.logger.info('Finalizing {}'.format(dev))
+                values = self.finish[dev]
+                device = self.devices[dev]['dev']
+                device.apply_values(values)
+                try:
+                    device.driver.finalize()
+                except:
+                    self.logger.warning('Failed to finalize driver {}'.fromat(dev))
+
+        # The DAQ models keep tasks open (e.g. for DC outputs), they are released even if not listed in finish.
+        # Devices whose driver was never initialized are skipped.
+        for name, entry in self.devices.initialized_items():
+            dev = entry['dev']
+            if dev.properties.get('type') == 'daq' and hasattr(dev.driver, 'finalize'):
+                try:
+                    dev.driver.finalize()
+                except Exception as e:
+                    self.logger.warning('Failed to release the tasks of {}: {}'.format(name, e))
 
 
 if __name__ == "__main__":
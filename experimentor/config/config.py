@@ -33,7 +33,8 @@ class Config(object):
     ni_read_timeout = 0
 
     class Laser:
-        number_checks_per_scan = 10  # How many times it checks if the 1D scan is done.
+        number_checks_per_scan = 10  # How many times it checks if the 1D scan is done, at least.
+        min_check_interval = 0.001  # Seconds. Checks start this often and slow down while the laser is sweeping.
 
     class NI:
         """ Default values for the National Instruments ADQ cards."""
@@ -18,9 +18,55 @@ from ..lib.general_functions import from_yaml_to_dict
 logger = logging.getLogger(__name__)
 
 
+class DeviceRegistry(dict):
+    """ Dictionary of devices that initializes the driver of a device the first time it is accessed. In this way,
+    devices that are defined in the configuration but not used by the experiment never talk to the real instrument.
+    """
+    def __init__(self):
+        super().__init__()
+        self.pending = set()  # Names of the devices whose driver was not yet initialized
+
+    def initialize(self, name):
+        """ Initializes the driver of the given device, unless it was already initialized."""
+        if name in self.pending:
+            logger.debug('Initializing the driver of {}'.format(name))
+            super().__getitem__(name)['dev'].initialize_driver()
+            # Only after success, so that a failed driver is tried again instead of returning an entry without driver
+            self.pending.discard(name)
+
+    def entry(self, name):
+        """ Returns the entry of a device without initializing its driver."""
+        return super().__getitem__(name)
+
+    def initialized_items(self):
+        """ Name and entry of the devices that have no driver pending to be initialized. It never initializes drivers."""
+        for name, entry in super().items():
+            if name not in self.pending:
+                yield name, entry
+
+    def __getitem__(self, name):
+        self.initialize(name)
+        return super().__getitem__(name)
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+
 class Experiment(object):
+    # The steps of the measurement are explicit attributes, any other step is available through dict_measure.
+    __slots__ = ('devices', 'actuators', 'sensors', 'loaded_devices', 'loaded_sensors', 'loaded_actuators',
+                 'dict_measure', 'init', 'scan', 'monitor', 'finish', 'logger')
+
     def __init__(self, measure):
-        self.devices = {}
+        self.devices = DeviceRegistry()
         self.actuators = {}
         self.sensors = {}
         self.loaded_devices = False
@@ -28,16 +74,19 @@ class Experiment(object):
         self.loaded_actuators = False
 
         self.dict_measure = measure  # Dictionary of the measurement steps
-        # This short block is going to become useful in the future, when interfacing with a GUI
-        for d in measure:
-            setattr(self, d, measure[d])
+        # Each step can be accessed by name, this is going to become useful in the future, when interfacing with a GUI
+        self.init = measure.get('init')
+        self.scan = measure.get('scan')
+        self.monitor = measure.get('monitor')
+        self.finish = measure.get('finish')
 
         print(__name__)
         self.logger = logging.getLogger(__name__)
         self.logger.info('creating an instance of Auxiliary')
             
     def load_devices(self, devices_dict, source=None):
-        """ Loads the devices from a dictionary.
+        """ Loads the devices from a dictionary. The drivers are not initialized here, but the first time a device is
+        accessed or when calling :meth:`initialize_devices`.
         :param devices_dict: Dictionary of devices.
         :param source: Not implemented yet.
         """
@@ -52,7 +101,7 @@ class Experiment(object):
                                      'sensors': {}}
                 self.logger.debug('Added {} to the experiment'.format(dev))
                 if 'driver' in devices_dict[dev]:
-                    self.devices[dev]['dev'].initialize_driver()
+                    self.devices.pending.add(dev)
 
             else:
                 self.logger.warning('Trying to load {}, but already exists'.format(dev))
@@ -75,23 +124,43 @@ class Experiment(object):
         for dev in actuators_dict:
             if dev not in self.devices:
                 raise Exception('The device specified in the Actuator file does not exist in the device file')
+            # Registering the actuators does not need the driver of the device
+            entry = self.devices.entry(dev)
             # Get all the actuators connected to the device
             acts = actuators_dict[dev]
+            defaults = []
             for act in acts:
                 act_data = acts[act]
                 act_data['name'] = act  # Explicitly add the name
 
-                if act in self.devices[dev]['actuators']:
+                if act in entry['actuators']:
                     raise Exception('Actuator possibly double defined. Check that there are no two actuators with \
                                     the same main key connected to the same device.')
-                self.devices[dev]['actuators'][act] = Actuator(act_data)
-                self.devices[dev]['actuators'][act].device = self.devices[dev]['dev']
+                entry['actuators'][act] = Actuator(act_data)
+                entry['actuators'][act].device = entry['dev']
 
                 self.logger.debug('Added {} to the actuators'.format(act_data['name']))
                 if 'default' in act_data:
                     self.logger.debug('Defaults for {} detected'.format(act_data['name']))
-                    self.logger.info('Set {} to {}'.format(act_data['name'], Q_(act_data['default'])))
-                    self.devices[dev]['actuators'][act].value = Q_(act_data['default'])
+                    defaults.append(act)
+
+            if not defaults:
+                continue
+
+            # Setting the defaults does need the driver. Drivers that support it write all of them at once
+            self.devices.initialize(dev)
+            driver = entry['dev'].driver
+            batch = hasattr(driver, 'async_begin')
+            if batch:
+                driver.async_begin()
+            try:
+                for act in defaults:
+                    value = Q_(acts[act]['default'])
+                    self.logger.info('Set {} to {}'.format(act, value))
+                    entry['actuators'][act].value = value
+            finally:
+                if batch:
+                    driver.async_end()
 
         self.loaded_actuators = True
         return True
@@ -111,33 +180,42 @@ class Experiment(object):
         for dev in sensors_dict:
             if dev not in self.devices:
                 raise Exception('The device specified in the Sensor file does not exist in the device file.')
+            entry = self.devices.entry(dev)  # Registering the sensors does not need the driver of the device
             # get all the sensors connected to the device
             sens = sensors_dict[dev]
             for sen in sens:
                 sen_data = sens[sen]
                 sen_data['name'] = sen  # Explicitly adding the name of the sensor
-                if sen in self.devices[dev]['sensors']:
+                if sen in entry['sensors']:
                     raise Exception('Sensor possibly double defifned. Check that there are no two actuators with \
                                     the same main key connected to the same device.')
-                self.devices[dev]['sensors'][sen] = Sensor(sen_data)
+                entry['sensors'][sen] = Sensor(sen_data)
                 self.logger.debug('Added {} to sensors'.format(sen_data['name']))
         self.loaded_sensors = True
         return True
 
-    def initialize_devices(self):
+    def initialize_devices(self, devices=None):
         """ Initializes the devices. It means that it will load the appropriate drivers.
+        Devices not initialized here will be initialized the first time they are accessed.
+
+        :param devices: Names of the devices to initialize. If None, all the loaded devices are initialized.
         """
         if not self.loaded_devices:
             raise Exception('Devices have to be loaded before being initialized.')
 
-        for dev in self.devices:
-            d = self.devices[dev]['dev'] # This is the Device instance
-            d.initialize_driver()
+        if devices is None:
+            devices = list(self.devices.keys())
+
+        for dev in devices:
+            if dev not in self.devices:
+                self.logger.warning('Trying to initialize {}, but it was not loaded'.format(dev))
+                continue
+            self.devices.initialize(dev)
 
     def initalize(self):
         pass
 
     def finalize(self):
         """ What to do when the program finishes."""
-        if not hasattr(self, 'finish'):
+        if self.finish is None:
             self.logger.warning('Class does not have a finalize statement')
@@ -35,6 +35,7 @@ class Actuator:
         self._properties = properties
         self._device = None
         self._value = None
+        self._limits = None
 
         logger.info('Started actuator {}'.format(self.name))
 
@@ -61,8 +62,9 @@ class Actuator:
             err_str = "Trying to update a value of {} before connecting it to a device".format(self.name)
             logger.error(err_str)
             raise Exception(err_str)
-        if 'limits' in self.properties:
-            if value > Q_(self.properties['limits']['max']) or value < Q_(self.properties['limits']['min']):
+        limits = self.limits
+        if limits is not None:
+            if value > limits[1] or value < limits[0]:
                 wrn_msg = 'Trying to set {} to {}, while limits are ({}, {})'.format(self.name, value, self.properties['limits']['min'], self.properties['limits']['max'])
                 logger.warning(wrn_msg)
                 raise Warning(wrn_msg)
@@ -74,6 +76,14 @@ class Actuator:
             logger.error("Failed to apply {} to {}: {}".format(value, self.name, e))
             raise e
 
+    @property
+    def limits(self):
+        """ Minimum and maximum values of the actuator as Quantities, or None if it has no limits.
+        They are parsed from the properties only once."""
+        if self._limits is None and 'limits' in self.properties:
+            self._limits = (Q_(self.properties['limits']['min']), Q_(self.properties['limits']['max']))
+        return self._limits
+
     @property
     def properties(self):
         return self._properties
@@ -20,12 +20,17 @@
 """
 import logging
 import importlib
+from collections import namedtuple
+
 from .. import Q_
 from .actuator import Actuator
 from .sensor import Sensor
 
 logger = logging.getLogger(__name__)
 
+#: How a device is connected to the computer. device is the name of the device it goes through (e.g. a DAQ), if any.
+Connection = namedtuple('Connection', ['type', 'port', 'device'])
+
 
 class Device:
     """
@@ -43,6 +48,11 @@ class Device:
             self._name = 'nameless'
 
         self._properties = properties
+        if 'connection' in properties:
+            connection = properties['connection']
+            self._connection = Connection(connection.get('type'), connection.get('port'), connection.get('device'))
+        else:
+            self._connection = None
         self.driver = None
         self._params = {}
 
@@ -69,13 +79,13 @@ class Device:
         if 'driver' in self._properties:
             d = self._properties['driver'].split('/')
             driver_class = getattr(importlib.import_module(d[0]), d[1])
-            if 'connection' in self._properties:
-                connection_type = self._properties['connection']['type']
+            if self._connection is not None:
+                connection_type = self._connection.type
                 logger.debug('Initializing {} connection'.format(connection_type))
                 try:
                     if connection_type == 'GPIB':
                         # Assume it is a lantz driver
-                        self.driver = driver_class.via_gpib(self._properties['connection']['port'])
+                        self.driver = driver_class.via_gpib(self._connection.port)
                         self.driver.initialize()
                     elif connection_type == 'USB':
                         # Assume it is a lantz driver
@@ -85,12 +95,12 @@ class Device:
                         raise Warning('This was never tested!')
                     elif connection_type == 'serial':
                         # Assume it is a lantz driver
-                        self.driver = driver_class.via_serial(self._properties['connection']['port'])
+                        self.driver = driver_class.via_serial(self._connection.port)
                         self.driver.initialize()
                         logger.warning('Connection {} was never tested.'.format(connection_type))
                         raise Warning('This was never tested!')
                     elif connection_type == 'daq':
-                        self.driver = driver_class(self._properties['connection']['port'])
+                        self.driver = driver_class(self._connection.port)
                 except:
                     logger.error('{} driver for {} not initialized'.format(connection_type, self._name))
                     raise Exception('Driver not initialized')
@@ -165,5 +175,10 @@ class Device:
     def properties(self):
         return self._properties
 
+    @property
+    def connection(self):
+        """ The connection of the device as a :class:`Connection`, or None if the properties do not define one."""
+        return self._connection
+
     def __str__(self):
         return self._name
\ No newline at end of file
@@ -9,8 +9,18 @@
     .. sectionauthor:: Aquiles Carattino <aquiles@uetke.com>
 
 """
+import os
 import sys
+import copy
+import json
+from functools import lru_cache
+
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader  # LibYAML bindings, much faster than the pure-Python parser
+except ImportError:
+    from yaml import SafeLoader
+
 from .device import Device
 from .logger_with_time import logger
 from .. import Q_
@@ -23,8 +33,7 @@ def from_yaml_to_devices(filename = "config/devices.yml", name=None):
     :return: list of devices
     :type return: Device
     """
-    with open(filename, 'r') as stream:
-        devices = yaml.load(stream)
+    devices = from_yaml_to_dict(filename)
     devs = {}
     if name is not None:
         if name in devices:
@@ -41,8 +50,46 @@ def from_yaml_to_devices(filename = "config/devices.yml", name=None):
 
 
 def from_yaml_to_dict(filename='config/measurement.yml'):
+    """ Reads a YAML file and returns its contents. Parsed files are cached, keyed by their modification time, both in
+    memory and in a sidecar ``<filename>.cache.json``; the YAML is parsed again only when the file changes on disk.
+
+    :param filename: File where the data is stored
+    :return: the contents of the file, normally a dictionary.
+    """
+    filename = os.path.abspath(filename)
+    output = _cached_yaml(filename, os.path.getmtime(filename))
+    # The rest of the program modifies the dictionaries it gets (adding names, overriding parameters, etc.), a copy
+    # prevents those changes from leaking into the cache.
+    return copy.deepcopy(output)
+
+
+@lru_cache(maxsize=None)
+def _cached_yaml(filename, mtime):
+    """ Parses a YAML file, reusing the sidecar JSON cache if it was generated for the same modification time.
+    The cache is only written when the contents survive a round trip through JSON (i.e. no dates, non-string keys,
+    etc.); failing to read or write it is never an error, the file is just parsed again.
+
+    :param filename: Absolute path to the YAML file
+    :param mtime: Modification time of the file, only used as part of the cache key.
+    """
+    cache_file = filename + '.cache.json'
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+        if cached['mtime'] == mtime:
+            return cached['data']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
     with open(filename, 'r') as stream:
-        output = yaml.load(stream)
+        output = yaml.load(stream, Loader=SafeLoader)
+
+    try:
+        if json.loads(json.dumps(output)) == output:
+            with open(cache_file, 'w') as f:
+                json.dump({'mtime': mtime, 'data': output}, f)
+    except (OSError, ValueError, TypeError):
+        pass
     return output
 
 
@@ -23,6 +23,8 @@ class camera(cameraBase):
         self.ysize = 2048
         self.maxX = 2048
         self.maxY = 2048
+        self._rng = np.random.default_rng()
+        self._noise = None  # Reused between frames, see readCamera
 
     def initializeCamera(self):
         """Initializes the camera.
@@ -70,8 +72,13 @@ class camera(cameraBase):
     def readCamera(self):
         X,Y = self.getSize()
         try:
-            sample = np.random.normal(size=(X,Y))
-            sample = sample.astype('uint16')
+            # The noise is generated in single precision into a buffer reused between frames and cast straight into
+            # the new frame, instead of allocating a double precision image and a converted copy every time.
+            if self._noise is None or self._noise.shape != (X, Y):
+                self._noise = np.empty((X, Y), dtype=np.float32)
+            self._rng.standard_normal(dtype=np.float32, out=self._noise)
+            sample = np.empty((X, Y), dtype='uint16')
+            np.copyto(sample, self._noise, casting='unsafe')
         except:
             sample = np.zeros((X,Y))
         # img = np.reshape(sample,(X,Y))
@@ -1,2 +1,3 @@
 # -*- coding: utf-8 -*-
-from .ni6251 import NI
\ No newline at end of file
+from .ni6251 import NI
+from ._skeleton import DaqTask
@@ -1,5 +1,37 @@
+import logging
+
 from ..models import Model
 
+logger = logging.getLogger(__name__)
+
+
+class DaqTask(object):
+    """ Context manager around a task of a DAQ. Leaving the context stops and clears the task. Errors while doing so,
+    for example because the task had already been stopped, are logged but not raised; in this way a task can always
+    be released, also after an exception and without first asking the card whether the task is complete.
+
+        >>> with DaqTask(daq, daq.analog_input_setup(conditions)) as task:
+        ...     daq.trigger_analog(task)
+
+    :param driver: The DAQ model that owns the task, it has to provide stop_task and clear_task.
+    :param task: The task number, as returned by the driver.
+    """
+    def __init__(self, driver, task):
+        self.driver = driver
+        self.task = task
+
+    def __enter__(self):
+        return self.task
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for release in (self.driver.stop_task, self.driver.clear_task):
+            try:
+                release(self.task)
+            except Exception as e:
+                logger.warning('Problem releasing task {}: {}'.format(self.task, e))
+        return False
+
+
 class Daq(Model):
     def __init__(self):
         super().__init__()
@@ -10,7 +10,7 @@
      .. sectionauthor:: Aquiles Carattino <aquiles@uetke.com>
 """
 import logging
-import time
+import threading
 
 import PyDAQmx as nidaq
 import numpy as np
@@ -24,6 +24,9 @@ logger = logging.getLogger(__name__)
 
 class NI(Daq):
     model = "6251"
+    _async_methods = ('analog_input_setup', 'analog_output_dc', 'read_analog', 'read_analog_into', 'stop_task',
+                      'clear_task')
+
     def __init__(self, daq_num=1):
         """Class trap for condensing tasks that can be used for interacting with an optical trap.
         session -- class with important variables, including the adq card.
@@ -33,6 +36,11 @@ class NI(Daq):
         self.monitorNum = []
         self.tasks = []
         self.nidaq = nidaq
+        self._output_buffer = None  # DC outputs waiting to be written, see async_begin
+        self._output_tasks = {}  # Task and voltage range kept open for each DC output port, see _output_dc
+        self._calibrations = {}  # Units, slope and offset of each device, see from_units_to_volts
+        # The outputs can be set from the thread pool of the *_async methods
+        self._output_lock = threading.RLock()
         self.logger = logging.getLogger(__name__)
         self.logger.info('Started NI instrument with number: {}'.format(daq_num))
 
@@ -69,14 +77,8 @@ class NI(Daq):
             min_V = from_units_to_volts(min_value, calibration)
             max_V = from_units_to_volts(max_value, calibration)
 
-            autostart = nidaq.bool32(True)
-            timeout = Config.NI.Output.Analog.timeout
             self.logger.debug('Actuator: {}, MIN: {}, MAX: {}, Value: {}'.format(actuator.name, min_V, max_V, output_volts))
-            t = nidaq.Task()
-            t.CreateAOVoltageChan(port, None, min_V, max_V, nidaq.DAQmx_Val_Volts, None)
-            t.WriteAnalogScalarF64(autostart, timeout, output_volts, None)
-            t.StopTask()
-            t.ClearTask()
+            self._output_dc(port, output_volts, min_V, max_V)
 
         self.logger.info('Changed the value of {} to {}'.format(actuator.name, value))
 
@@ -110,7 +112,8 @@ class NI(Daq):
                                   max_V, nidaq.DAQmx_Val_Volts, None)
             t.CfgSampClkTiming(trigger, freq, trigger_edge, cont_finite, num_points)
             t.StartTask()
-            time.sleep(num_points*freq)
+            # Returns as soon as the acquisition is done, waiting at most twice the expected time
+            self._wait_until_done(t, 2*num_points*freq)
             timeout = Config.NI.Input.Analog.read_timeout
             read = nidaq.int32()
             data = np.zeros((num_points,), dtype=np.float64)
@@ -137,7 +140,7 @@ class NI(Daq):
             channel = []
             limit_max = []
             limit_min = []
-            for dev in conditions['devices']:
+            for dev in sensors:
                 channel.append("Dev%s/ai%s" % (self.daq_num, dev.properties['port']))
                 limit_min.append(dev.properties['limits']['min'])
                 limit_max.append(dev.properties['limits']['max'])
@@ -223,6 +226,25 @@ class NI(Daq):
         values = read.value
         return values, data
 
+    def read_analog_into(self, task, buffer):
+        """ Reads all the samples available for a task into a preallocated array with one column per channel and
+        one row per sample, i.e. of shape (samples, channels). Nothing is allocated, which matters when polling
+        continuous acquisitions at high rates.
+
+        :param task: Task number to read from. If None, the last registered task.
+        :param buffer: C-contiguous float64 array where the data will be stored. It limits how many samples can be
+            read at once.
+        :return: The number of samples read per channel; ``buffer[:n].T`` are views with one row per channel.
+        """
+        if task is None:
+            task = -1
+        t = self.tasks[task]
+
+        read = nidaq.int32()
+        t.ReadAnalogF64(-1, Config.ni_read_timeout, nidaq.DAQmx_Val_GroupByScanNumber,
+                        buffer, buffer.size, nidaq.byref(read), None)
+        return read.value
+
     def from_volt_to_units(self, value, dev):
         pass
 
@@ -234,14 +256,16 @@ class NI(Daq):
         :type value: Quantity
         :type dev: dict.
         """
-        units = Q_(dev.properties['calibration']['units'])
-        slope = dev.properties['calibration']['slope'] * units
-        offset = dev.properties['calibration']['offset'] * units
-        value = value.to(units)
-        value = value.m
-        slope = slope.m
-        offset = offset.m
-        return (value - offset) / slope
+        # The calibration is parsed only the first time a device is used, outputs are set at every point of a scan
+        try:
+            units, slope, offset = self._calibrations[dev]
+        except KeyError:
+            calibration = dev.properties['calibration']
+            units = Q_(calibration['units'])
+            slope = (calibration['slope'] * units).m
+            offset = (calibration['offset'] * units).m
+            self._calibrations[dev] = (units, slope, offset)
+        return (value.to(units).m - offset) / slope
 
     def analog_output_dc(self, conditions):
         """ Sets the analog output of the NI card. For the time being is thought as a DC constant value.
@@ -259,11 +283,73 @@ class NI(Daq):
         V = self.from_units_to_volts(value, dev)
         min_V = self.from_units_to_volts(min_value, dev)
         max_V = self.from_units_to_volts(max_value, dev)
-        t = nidaq.Task()
-        t.CreateAOVoltageChan(port, None, min_V, max_V, nidaq.DAQmx_Val_Volts, None)
-        t.WriteAnalogScalarF64(nidaq.bool32(True), 0, V, None)
-        t.StopTask()
-        t.ClearTask()
+        self._output_dc(port, V, min_V, max_V)
+
+    def _output_dc(self, port, V, min_V, max_V):
+        """ Writes a DC voltage to an analog output port, or buffers it if :meth:`async_begin` was called.
+        The task of each port is created the first time and kept open, so setting a port repeatedly (for example at
+        every point of a scan) is a single write to the card. It is released by :meth:`finalize`.
+
+        :param str port: Physical channel, for example Dev1/ao0
+        :param V: Voltage to output
+        :param min_V: Minimum voltage of the channel
+        :param max_V: Maximum voltage of the channel
+        """
+        with self._output_lock:
+            if self._output_buffer is not None:
+                self._output_buffer[port] = (V, min_V, max_V)
+                return
+
+            if port in self._output_tasks and self._output_tasks[port][1:] != (min_V, max_V):
+                self._release_output(port)
+            if port not in self._output_tasks:
+                t = nidaq.Task()
+                t.CreateAOVoltageChan(port, None, min_V, max_V, nidaq.DAQmx_Val_Volts, None)
+                self._output_tasks[port] = (t, min_V, max_V)
+            t = self._output_tasks[port][0]
+            t.WriteAnalogScalarF64(nidaq.bool32(True), Config.NI.Output.Analog.timeout, V, None)
+
+    def _release_output(self, port):
+        """ Stops and clears the task kept open for a DC output port, if there is one."""
+        with self._output_lock:
+            if port in self._output_tasks:
+                t = self._output_tasks.pop(port)[0]
+                t.StopTask()
+                t.ClearTask()
+
+    def async_begin(self):
+        """ Starts buffering the DC analog outputs. Values set with :meth:`apply_value` or :meth:`analog_output_dc`
+        are not sent to the card until :meth:`async_end` is called, saving one task per value.
+        """
+        with self._output_lock:
+            self._output_buffer = {}
+
+    def async_end(self):
+        """ Writes all the DC analog outputs buffered since :meth:`async_begin` with a single task and a single write.
+        If a port was set several times, only the last value is written.
+        """
+        with self._output_lock:
+            buffer = self._output_buffer
+            self._output_buffer = None
+            if not buffer:
+                return
+
+            t = nidaq.Task()
+            try:
+                volts = np.zeros((len(buffer),), dtype=np.float64)
+                for i, port in enumerate(buffer):
+                    self._release_output(port)  # A channel can't belong to two tasks at the same time
+                    V, min_V, max_V = buffer[port]
+                    t.CreateAOVoltageChan(port, None, min_V, max_V, nidaq.DAQmx_Val_Volts, None)
+                    volts[i] = V
+                written = nidaq.int32()
+                t.WriteAnalogF64(1, nidaq.bool32(True), Config.NI.Output.Analog.timeout,
+                                 nidaq.DAQmx_Val_GroupByChannel, volts, nidaq.byref(written), None)
+            finally:
+                # Also if the write fails, otherwise the task keeps the channels reserved
+                t.StopTask()
+                t.ClearTask()
+        self.logger.debug('Wrote {} buffered analog outputs'.format(len(buffer)))
 
     def analog_output_samples(self, conditions):
         """ Prepares an anlog output from an array of values.
@@ -277,8 +363,9 @@ class NI(Daq):
         min_val = self.from_units_to_volts(dev.properties['limits']['min'], dev)
         max_val = self.from_units_to_volts(dev.properties['limits']['max'], dev)
 
-        t.CreateAOVoltageChan('Dev%s/ao%s' % (self.daq_num, port), None, min_val, max_val, nidaq.DAQmx_Val_Volts,
-                              None, )
+        port = 'Dev%s/ao%s' % (self.daq_num, port)
+        self._release_output(port)  # A channel can't belong to two tasks at the same time
+        t.CreateAOVoltageChan(port, None, min_val, max_val, nidaq.DAQmx_Val_Volts, None, )
 
         freq = int(1 / conditions['accuracy'].to('s').magnitude)
         num_points = len(conditions['data'])
@@ -305,6 +392,19 @@ class NI(Daq):
         t.GetTaskComplete(d)
         return d.value
 
+    def _wait_until_done(self, t, timeout):
+        """ Blocks in DAQmx until the task t is done or the timeout (in seconds) expires.
+
+        :return: True if the task completed, False if the timeout expired first.
+        """
+        try:
+            t.WaitUntilTaskDone(timeout)
+        except nidaq.DAQError as e:
+            if e.error == nidaq.DAQmxErrorWaitUntilDoneDoesNotIndicateDone:
+                return False
+            raise
+        return True
+
     def stop_task(self, task):
         t = self.tasks[task]
         t.StopTask()
@@ -314,4 +414,12 @@ class NI(Daq):
         t.ClearTask()
 
     def reset_device(self):
-        nidaq.DAQmxResetDevice('Dev%s' % self.daq_num)
+        with self._output_lock:
+            self._output_tasks = {}  # Resetting the device aborts and clears all its tasks
+            nidaq.DAQmxResetDevice('Dev%s' % self.daq_num)
+
+    def finalize(self):
+        """ Releases the tasks kept open for the DC outputs."""
+        with self._output_lock:
+            for port in list(self._output_tasks):
+                self._release_output(port)
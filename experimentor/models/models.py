@@ -5,15 +5,52 @@ Models are a buffer between user interactions and real devices. Models should de
 for example how to read a value from a sensor and how to apply a value to an actuator.
 Models can also take care of manipulating data, for example calculating an FFT and returning it to the user.
 
+Models can list some of their methods in ``_async_methods``. For each of them, a ``<method>_async`` variant is
+generated that runs the method in a thread pool shared by all the models and returns a
+:class:`concurrent.futures.Future`. In this way, independent commands to different devices can overlap:
+
+    >>> futures = [daq.driver.read_analog_async(task, conditions) for daq, task in tasks]
+    >>> results = [f.result() for f in futures]
+
 """
+from concurrent.futures import ThreadPoolExecutor
+
 from experimentor.lib import Actuator, Sensor
 
-class Model(object):
+# Thread pool shared by all the models. It is created here, and not on first use, so that two threads can't create
+# one each. Its threads are only started when something is submitted.
+_executor = ThreadPoolExecutor(thread_name_prefix='experimentor-model')
+
+
+def _make_async(method_name):
+    """ Creates the asynchronous variant of a method. The method is looked up when called, so subclasses
+    overriding it get their own implementation run in the pool."""
+    def method_async(self, *args, **kwargs):
+        return _executor.submit(getattr(self, method_name), *args, **kwargs)
+
+    method_async.__name__ = method_name + '_async'
+    method_async.__doc__ = 'Runs :meth:`{}` in the shared thread pool and returns a Future with its result.'.format(
+        method_name)
+    return method_async
+
+
+class ModelMeta(type):
+    """ Metaclass of the models. It generates the asynchronous variants of the methods listed in ``_async_methods``.
+    """
+    def __new__(mcs, name, bases, namespace):
+        cls = super().__new__(mcs, name, bases, namespace)
+        for method_name in namespace.get('_async_methods', ()):
+            setattr(cls, method_name + '_async', _make_async(method_name))
+        return cls
+
+
+class Model(object, metaclass=ModelMeta):
     """
     Base class that is inherited by the rest of the models.
     """
     _driver = None
     _name = None
+    _async_methods = ('apply_value', 'read_value')
 
     @property
     def driver(self):
@@ -28,10 +28,14 @@
     .. sectionauthor:: Aquiles Carattino <aquiles@aquicarattino.com>
 """
 
+import logging
+
 import h5py
 import numpy as np
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 def workerSaver(fileData, meta, q):
     """Function that can be run in a separate thread for continuously save data to disk.
 
@@ -85,6 +89,44 @@ def workerSaver(fileData, meta, q):
     f.close()
     print('Finish writing to disk')
 
+def workerScanSaver(fileData, meta, q):
+    """Function that can be run in a separate thread for continuously saving 1D scan data to disk. Every item in the
+    queue is a tuple with the name of a sensor and an array of new data, which is appended to the dataset with the
+    name of the sensor. As with workerSaver, it runs until it finds a string as the next item. If writing fails, the
+    error is logged, the file is closed and the function returns.
+
+    :param str fileData: the path to the file to use.
+    :param str meta: Metadata. It is kept as a string in order to provide flexibility for other programs.
+    :param Queue q: Queue that will store the (name, data) tuples to be saved to disk.
+    """
+    f = None
+    try:
+        f = h5py.File(fileData, "a")  # This will append the file.
+        now = str(datetime.now())
+        g = f.create_group(now)
+        g.create_dataset('metadata', data=meta.encode("ascii","ignore"))
+
+        while True:
+            item = q.get()  # Blocks until there is new data, no need to spin on the queue
+            if isinstance(item, str):
+                break
+            name, data = item
+            if name not in g:
+                g.create_dataset(name, data=data, maxshape=(None,), chunks=True)
+            else:
+                dset = g[name]
+                n = dset.shape[0]
+                dset.resize((n+len(data),))
+                dset[n:] = data
+        f.flush()
+    except Exception:
+        # The thread ends here, the one putting data on the queue has to check that it is still alive
+        logger.exception('Failed to save the scans to {}'.format(fileData))
+    finally:
+        if f is not None:
+            f.close()
+
+
 def clearQueue(q):
     """Clears the queue by reading it.
 